@@ -4,6 +4,7 @@ Main Streamlit application for anime recommendations.
 import streamlit as st
 import time
 from graph.graph import app
+from utils.query_cache import cached_invoke, SOURCE_MISS
 from ui.components import (
     render_custom_css,
     render_sidebar,
@@ -29,32 +30,44 @@ st.markdown("Powered by AI and semantic search")
 render_sidebar()
 
 # Main interface
-user_query = st.text_input(
-    "What kind of anime are you looking for?",
-    placeholder="e.g., I want a shonen anime with good fights"
-)
+# A form submits once per Enter or button press, so reruns do not re-serve (and re-log) the query
+with st.form("query_form"):
+    user_query = st.text_input(
+        "What kind of anime are you looking for?",
+        placeholder="e.g., I want a shonen anime with good fights"
+    )
+    submitted = st.form_submit_button("Get Recommendations", type="primary")
 
-if st.button("Get Recommendations", type="primary") or user_query:
+if submitted:
     if user_query:
         with st.spinner("Finding the perfect anime for you..."):
             start_time = time.time()
             
             try:
-                # Get recommendations from the graph
-                result = app.invoke({"input_text": user_query})
+                # Get recommendations from the cache, falling back to the graph
+                result, source = cached_invoke(app, user_query)
                 end_time = time.time()
                 
-                # Display success message
-                st.success(f"✨ Found recommendations in {end_time - start_time:.2f} seconds!")
-                
-                # Render recommendations with images
-                recommendations = result.get('recommended_anime', [])
-                render_recommendations(recommendations)
+                # Keep the result so later reruns can redisplay it without serving again
+                st.session_state["last_result"] = (result, source, end_time - start_time)
                     
             except Exception as e:
+                st.session_state.pop("last_result", None)
                 st.error(f"An error occurred: {e}")
     else:
+        st.session_state.pop("last_result", None)
         st.warning("Please enter a query to get recommendations!")
 
+if "last_result" in st.session_state:
+    result, source, elapsed = st.session_state["last_result"]
+    
+    # Display success message
+    cache_note = "" if source == SOURCE_MISS else " (cached)"
+    st.success(f"✨ Found recommendations in {elapsed:.2f} seconds{cache_note}!")
+    
+    # Render recommendations with images
+    recommendations = result.get('recommended_anime', [])
+    render_recommendations(recommendations)
+
 # Footer
 render_footer()
@@ -0,0 +1,182 @@
+"""
+Tests for the serving cache and the cache warming job.
+"""
+import os
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+import warm_cache
+from utils.query_cache import PRIORITY_LIVE, PRIORITY_WARM, QueryCache
+
+
+RESULT = {
+    "redefine_input_content": "Action-packed shonen anime",
+    "context": [Document(page_content="Title: Naruto", metadata={"title": "Naruto"})],
+    "recommended_anime": [{"title": "Naruto"}],
+}
+
+
+class FakeEmbeddings:
+    """Embeds queries with fixed vectors instead of a sentence-transformers model."""
+
+    def __init__(self, vectors: dict):
+        self.vectors = vectors
+
+    def embed_documents(self, texts):
+        return [self.vectors[text] for text in texts]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return QueryCache(cache_dir=str(tmp_path), max_entries=2, ttl=3600, version="test")
+
+
+def _set_last_access(cache, query, mtime):
+    _, _, path = cache._find(query)[0]
+    os.utime(path, (mtime, mtime))
+
+
+def _age_entries(cache, seconds):
+    """Moves every entry's creation time `seconds` into the past."""
+    for priority, _, created_at, digest, path in cache._entries():
+        os.replace(path, cache._entry_path(digest, priority, created_at - seconds))
+
+
+def _records(counts: dict) -> list:
+    return [{"query": query} for query, count in counts.items() for _ in range(count)]
+
+
+def test_live_entries_are_evicted_before_warm_entries(cache):
+    cache.put("warm", RESULT, priority=PRIORITY_WARM)
+    cache.put("live 1", RESULT)
+    _set_last_access(cache, "warm", 0)
+    cache.put("live 2", RESULT)
+
+    assert cache.get("warm")[1] == PRIORITY_WARM
+    assert cache.get("live 1") == (None, None)
+    assert cache.get("live 2")[1] == PRIORITY_LIVE
+
+
+def test_least_recently_used_live_entry_is_evicted(cache):
+    cache.put("live 1", RESULT)
+    cache.put("live 2", RESULT)
+    _set_last_access(cache, "live 1", 100)
+    _set_last_access(cache, "live 2", 200)
+    cache.get("live 1")
+    cache.put("live 3", RESULT)
+
+    assert cache.get("live 1")[1] == PRIORITY_LIVE
+    assert cache.get("live 2") == (None, None)
+    assert cache.get("live 3")[1] == PRIORITY_LIVE
+
+
+def test_live_write_keeps_warm_priority(cache):
+    cache.put("Shonen fights", RESULT, priority=PRIORITY_WARM)
+    cache.put("shonen  FIGHTS!", RESULT)
+
+    assert cache.get("shonen fights")[1] == PRIORITY_WARM
+    assert len(cache) == 1
+
+
+def test_demote_warm_entries(cache):
+    cache.put("kept", RESULT, priority=PRIORITY_WARM)
+    cache.put("dropped", RESULT, priority=PRIORITY_WARM)
+    cache.demote_warm_entries({"kept"})
+
+    assert cache.get("kept")[1] == PRIORITY_WARM
+    assert cache.get("dropped")[1] == PRIORITY_LIVE
+
+
+def test_expired_entries_are_misses_and_purged_first(cache):
+    cache.put("warm", RESULT, priority=PRIORITY_WARM)
+    _age_entries(cache, 2 * 3600)
+
+    assert cache.get("warm") == (None, None)
+
+    cache.put("live 1", RESULT)
+    cache.put("live 2", RESULT)
+
+    assert len(cache) == 2
+    assert cache.get("live 1")[1] == PRIORITY_LIVE
+    assert cache.get("live 2")[1] == PRIORITY_LIVE
+
+
+def test_empty_results_are_not_cached(cache):
+    assert not cache.put("outage", {**RESULT, "context": []})
+    assert not cache.put("no picks", {**RESULT, "recommended_anime": []})
+    assert len(cache) == 0
+
+
+def test_other_versions_are_misses(tmp_path):
+    QueryCache(cache_dir=str(tmp_path), version="old").put("naruto", RESULT)
+
+    assert QueryCache(cache_dir=str(tmp_path), version="new").get("naruto") == (None, None)
+
+
+def test_cached_result_round_trips(cache):
+    cache.put("naruto", RESULT)
+    result, _ = cache.get("naruto")
+
+    assert result["redefine_input_content"] == RESULT["redefine_input_content"]
+    assert result["context"][0].page_content == "Title: Naruto"
+    assert result["recommended_anime"] == RESULT["recommended_anime"]
+
+
+def test_select_queries_respects_min_count_and_top():
+    clusters = [
+        {"query": "a", "count": 6, "members": [
+            {"key": "a", "query": "a", "count": 4},
+            {"key": "a2", "query": "a2", "count": 2},
+            {"key": "a3", "query": "a3", "count": 1},
+        ]},
+        {"query": "b", "count": 3, "members": [
+            {"key": "b", "query": "b", "count": 1},
+            {"key": "b2", "query": "b2", "count": 1},
+            {"key": "b3", "query": "b3", "count": 1},
+        ]},
+        {"query": "c", "count": 2, "members": [{"key": "c", "query": "c", "count": 2}]},
+        {"query": "d", "count": 1, "members": [{"key": "d", "query": "d", "count": 1}]},
+    ]
+
+    selected = warm_cache.select_queries(clusters, top=2, min_count=2)
+    assert [member["key"] for member in selected] == ["a", "a2", "b"]
+
+    selected = warm_cache.select_queries(clusters, top=10, min_count=2)
+    assert [member["key"] for member in selected] == ["a", "a2", "b", "c"]
+
+
+def test_mine_queries_clusters_across_batch_boundary(monkeypatch):
+    vectors = {
+        "a": [1.0, 0.0, 0.0],
+        "b": [0.0, 1.0, 0.0],
+        "c": [0.0, 0.0, 1.0],
+        "a2": [1.0, 0.1, 0.0],
+        "c2": [0.0, 0.1, 1.0],
+    }
+    counts = {"a": 5, "b": 4, "c": 3, "a2": 2, "c2": 1}
+    monkeypatch.setattr(warm_cache, "get_embeddings", lambda: FakeEmbeddings(vectors))
+    monkeypatch.setattr(warm_cache, "SIMILARITY_BATCH_SIZE", 2)
+
+    clusters = warm_cache.mine_queries(_records(counts), similarity_threshold=0.9)
+
+    assert [[m["key"] for m in c["members"]] for c in clusters] == [["a", "a2"], ["b"], ["c", "c2"]]
+    assert [c["count"] for c in clusters] == [7, 4, 4]
+
+
+def test_mine_queries_batching_matches_single_batch(monkeypatch):
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(5, 16))
+    vectors = {
+        f"q{i}": list(centers[i % 5] + 0.3 * rng.normal(size=16))
+        for i in range(40)
+    }
+    counts = {query: 40 - i for i, query in enumerate(vectors)}
+    monkeypatch.setattr(warm_cache, "get_embeddings", lambda: FakeEmbeddings(vectors))
+
+    single_batch = warm_cache.mine_queries(_records(counts), similarity_threshold=0.8)
+    monkeypatch.setattr(warm_cache, "SIMILARITY_BATCH_SIZE", 3)
+    batched = warm_cache.mine_queries(_records(counts), similarity_threshold=0.8)
+
+    assert batched == single_batch
+    assert 1 < len(batched) < len(vectors)
@@ -0,0 +1,488 @@
+"""
+Serving cache and query log for anime recommendations.
+
+The cache stores the full graph output (refined query, retrieved context and
+final recommendations) keyed by the normalized user query. Entries written by
+the warming job (`warm_cache.py`) carry a higher priority than entries created
+from one-off live queries, so eviction always drops live entries first.
+"""
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from langchain_core.documents import Document
+
+# fcntl is only available on Unix; elsewhere the cache runs without a cross-process lock
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    HAS_FCNTL = False
+
+CACHE_DIR = os.getenv("QUERY_CACHE_DIR", ".cache/query_cache")
+QUERY_LOG_DIR = os.getenv("QUERY_LOG_DIR", "logs")
+MAX_CACHE_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "500"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", str(3 * 24 * 3600)))
+
+# Source files whose changes invalidate cached results (prompts, model, schemas, vector index)
+VERSIONED_SOURCES = (
+    "graph/nodes.py",
+    "graph/chains.py",
+    "graph/schemas.py",
+    "utils/vectore_search.py",
+)
+
+# Eviction priorities: lower values are evicted first
+PRIORITY_LIVE = 0
+PRIORITY_WARM = 1
+
+# Values recorded in the query log for each served request
+SOURCE_WARM = "warm"
+SOURCE_LIVE = "live"
+SOURCE_MISS = "miss"
+
+_query_cache = None
+_log_lock = threading.Lock()
+
+
+def get_cache_version() -> str:
+    """
+    Returns the cache version that results are stored under.
+
+    Uses QUERY_CACHE_VERSION if set, otherwise a hash of the graph's prompt,
+    model and vector index configuration, so a deploy that changes any of
+    them starts from an empty cache instead of serving stale results.
+
+    Returns:
+        str: Version string safe to use as a directory name.
+    """
+    version = os.getenv("QUERY_CACHE_VERSION")
+    if version:
+        return re.sub(r"[^\w.-]", "_", version)
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    digest = hashlib.sha256()
+    for relative_path in VERSIONED_SOURCES:
+        try:
+            with open(os.path.join(root, relative_path), "rb") as f:
+                digest.update(f.read())
+        except OSError:
+            continue
+    return digest.hexdigest()[:12]
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizes a user query so trivially different inputs share a cache key.
+
+    Args:
+        query (str): Raw user input.
+
+    Returns:
+        str: Lowercased query with collapsed whitespace and no trailing punctuation.
+    """
+    query = re.sub(r"\s+", " ", query.strip().lower())
+    return query.rstrip(" .!?")
+
+
+def _serialize_result(result: dict) -> dict:
+    """Converts a graph result into a JSON-serializable dict."""
+    context = [
+        {"page_content": doc.page_content, "metadata": doc.metadata}
+        if isinstance(doc, Document) else doc
+        for doc in result.get('context', [])
+    ]
+    recommended_anime = [
+        anime.model_dump() if hasattr(anime, 'model_dump') else anime
+        for anime in result.get('recommended_anime', [])
+    ]
+    return {
+        "redefine_input_content": result.get('redefine_input_content'),
+        "context": context,
+        "recommended_anime": recommended_anime,
+    }
+
+
+def _deserialize_result(data: dict) -> dict:
+    """Rebuilds a graph result from its cached form."""
+    context = [
+        Document(page_content=doc["page_content"], metadata=doc.get("metadata", {}))
+        if isinstance(doc, dict) else doc
+        for doc in data.get("context", [])
+    ]
+    return {
+        "redefine_input_content": data.get("redefine_input_content"),
+        "context": context,
+        "recommended_anime": data.get("recommended_anime", []),
+    }
+
+
+class QueryCache:
+    """
+    Directory-backed cache of graph results with priority-aware LRU eviction.
+
+    Entries live in a subdirectory per cache version, so results from another
+    version of the graph are never served. Each entry lives in its own file
+    named `<priority>-<query hash>-<created at>.json`, so a write only touches
+    its own entry and priority and age can be read without opening the file.
+    Reads bump the file's modification time, which serves as the last access
+    time shared by every process using the directory.
+
+    Entries older than the TTL are treated as misses and are purged before
+    any other eviction. Results with an empty context or no recommendations
+    (e.g. from a vector store outage) are never stored.
+
+    When the cache is full, the entry with the lowest priority is evicted,
+    least recently used first. Warmed entries therefore outlive live entries.
+    Writes, renames and evictions hold a file lock so the Streamlit app and
+    the warming job can share the cache safely.
+    """
+
+    def __init__(self, cache_dir: str = CACHE_DIR, max_entries: int = MAX_CACHE_ENTRIES,
+                 ttl: float = QUERY_CACHE_TTL, version: str = None):
+        self.root_dir = cache_dir
+        self.version = version or get_cache_version()
+        self.cache_dir = os.path.join(cache_dir, self.version)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _digest(key: str) -> str:
+        """Returns the filename hash of a normalized query."""
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+    def _entry_path(self, digest: str, priority: int, created_at: int) -> str:
+        """Returns the file path for an entry."""
+        return os.path.join(self.cache_dir, f"{priority}-{digest}-{created_at}.json")
+
+    def _entries(self) -> list:
+        """Returns (priority, last access, created at, digest, path) for every entry on disk."""
+        entries = []
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for item in it:
+                    if not item.name.endswith(".json"):
+                        continue
+                    try:
+                        priority, digest, created_at = item.name[:-len(".json")].split("-")
+                        entries.append(
+                            (int(priority), item.stat().st_mtime, int(created_at), digest, item.path)
+                        )
+                    except (ValueError, OSError):
+                        continue
+        except OSError:
+            pass
+        return entries
+
+    def _find(self, key: str) -> list:
+        """Returns (priority, created at, path) of every entry for a normalized query, best first."""
+        pattern = os.path.join(glob.escape(self.cache_dir), f"*-{self._digest(key)}-*.json")
+        matches = []
+        for path in glob.glob(pattern):
+            try:
+                priority, _, created_at = os.path.basename(path)[:-len(".json")].split("-")
+                matches.append((int(priority), int(created_at), path))
+            except ValueError:
+                continue
+        return sorted(matches, reverse=True)
+
+    def _is_expired(self, created_at: float) -> bool:
+        return time.time() - created_at > self.ttl
+
+    @contextmanager
+    def _locked(self):
+        """Holds the thread lock and an exclusive lock on the cache's lock file."""
+        with self._lock:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(os.path.join(self.cache_dir, ".lock"), "a") as lock_file:
+                if HAS_FCNTL:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if HAS_FCNTL:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write(self, path: str, entry: dict):
+        """Writes an entry atomically through a unique temporary file."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _evict(self):
+        """Purges expired entries, then evicts lowest-priority, least recently used entries."""
+        live = []
+        for entry in self._entries():
+            if self._is_expired(entry[2]):
+                try:
+                    os.remove(entry[4])
+                except OSError:
+                    pass
+            else:
+                live.append(entry)
+
+        excess = len(live) - self.max_entries
+        if excess <= 0:
+            return
+        for entry in sorted(live)[:excess]:
+            try:
+                os.remove(entry[4])
+            except OSError:
+                pass
+
+    def get(self, query: str):
+        """
+        Looks up a cached result for a query.
+
+        Args:
+            query (str): Raw user query.
+
+        Returns:
+            tuple: (result dict, priority) on a hit, (None, None) on a miss.
+        """
+        matches = self._find(normalize_query(query))
+        if not matches:
+            return None, None
+        priority, created_at, path = matches[0]
+        if self._is_expired(created_at):
+            return None, None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            # The entry was evicted, re-prioritized or replaced concurrently
+            return None, None
+        return _deserialize_result(entry["result"]), priority
+
+    def put(self, query: str, result: dict, priority: int = PRIORITY_LIVE):
+        """
+        Stores a graph result for a query.
+
+        An existing entry never has its priority lowered by a live write.
+        Results with an empty context or no recommendations are skipped.
+
+        Args:
+            query (str): Raw user query.
+            result (dict): Output of `app.invoke`.
+            priority (int): PRIORITY_WARM for precomputed entries, PRIORITY_LIVE otherwise.
+
+        Returns:
+            bool: True if the result was stored.
+        """
+        if not result.get('context') or not result.get('recommended_anime'):
+            return False
+        key = normalize_query(query)
+        entry = {
+            "query": key,
+            "result": _serialize_result(result),
+        }
+        try:
+            with self._locked():
+                matches = self._find(key)
+                if matches:
+                    priority = max(priority, matches[0][0])
+                path = self._entry_path(self._digest(key), priority, int(time.time()))
+                self._write(path, entry)
+                for _, _, old_path in matches:
+                    if old_path != path:
+                        os.remove(old_path)
+                self._evict()
+        except OSError as e:
+            print(f"Error saving query cache entry to {self.cache_dir}: {e}")
+            return False
+        return True
+
+    def demote_warm_entries(self, keep: set = frozenset()):
+        """
+        Lowers warmed entries not in `keep` to live priority.
+
+        Used by the warming job so queries that are no longer popular
+        become regular eviction candidates.
+
+        Args:
+            keep (set): Normalized queries that should stay warmed.
+        """
+        keep_digests = {self._digest(key) for key in keep}
+        try:
+            with self._locked():
+                for priority, _, created_at, digest, path in self._entries():
+                    if priority == PRIORITY_WARM and digest not in keep_digests:
+                        os.replace(path, self._entry_path(digest, PRIORITY_LIVE, created_at))
+        except OSError as e:
+            print(f"Error demoting query cache entries in {self.cache_dir}: {e}")
+
+    def purge_other_versions(self):
+        """
+        Deletes cache directories of other versions that have not changed within the TTL.
+
+        A directory with no writes for longer than the TTL only holds expired
+        entries. Newer ones are kept so instances still running the previous
+        version during a rolling deploy keep their cache.
+        """
+        cutoff = time.time() - self.ttl
+        try:
+            with os.scandir(self.root_dir) as it:
+                for item in it:
+                    if item.name == self.version or not item.is_dir():
+                        continue
+                    if item.stat().st_mtime < cutoff:
+                        shutil.rmtree(item.path, ignore_errors=True)
+        except OSError:
+            pass
+
+    def __len__(self):
+        return len(self._entries())
+
+
+def get_query_cache() -> QueryCache:
+    """
+    Returns the process-wide query cache (singleton).
+    """
+    global _query_cache
+
+    if _query_cache is None:
+        _query_cache = QueryCache()
+
+    return _query_cache
+
+
+def _log_day(ts: float) -> str:
+    """Returns the UTC date of an epoch time as YYYY-MM-DD."""
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y-%m-%d")
+
+
+def _log_shards(log_dir: str) -> list:
+    """Returns (day, path) for every daily query log file, oldest first."""
+    shards = []
+    try:
+        with os.scandir(log_dir) as it:
+            for item in it:
+                match = re.fullmatch(r"query_log-(\d{4}-\d{2}-\d{2})\.jsonl", item.name)
+                if match:
+                    shards.append((match.group(1), item.path))
+    except OSError:
+        pass
+    return sorted(shards)
+
+
+def log_query(query: str, source: str, latency: float = None, log_dir: str = QUERY_LOG_DIR):
+    """
+    Appends a served query to today's query log file (`query_log-YYYY-MM-DD.jsonl`, UTC).
+
+    Args:
+        query (str): Raw user query.
+        source (str): SOURCE_WARM, SOURCE_LIVE or SOURCE_MISS.
+        latency (float): Time taken to serve the request, in seconds.
+        log_dir (str): Query log directory.
+    """
+    now = time.time()
+    record = {"ts": now, "query": query, "source": source, "latency": latency}
+    path = os.path.join(log_dir, f"query_log-{_log_day(now)}.jsonl")
+    try:
+        with _log_lock:
+            os.makedirs(log_dir, exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+    except OSError as e:
+        print(f"Error writing query log to {path}: {e}")
+
+
+def read_query_log(log_dir: str = QUERY_LOG_DIR, since: float = None) -> list:
+    """
+    Reads query log records, skipping malformed lines.
+
+    Only the daily files that can hold records at or after `since` are opened.
+
+    Args:
+        log_dir (str): Query log directory.
+        since (float): Only return records with a timestamp at or after this epoch time.
+
+    Returns:
+        list: Query log records as dicts.
+    """
+    first_day = _log_day(since) if since is not None else None
+    records = []
+    for day, path in _log_shards(log_dir):
+        if first_day is not None and day < first_day:
+            continue
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if not record.get("query"):
+                        continue
+                    if since is not None and record.get("ts", 0) < since:
+                        continue
+                    records.append(record)
+        except OSError:
+            continue
+    return records
+
+
+def prune_query_log(before: float, log_dir: str = QUERY_LOG_DIR) -> int:
+    """
+    Deletes daily query log files that only hold records older than `before`.
+
+    Args:
+        before (float): Epoch time; files for days before this time's UTC date are deleted.
+        log_dir (str): Query log directory.
+
+    Returns:
+        int: Number of files deleted.
+    """
+    last_kept_day = _log_day(before)
+    deleted = 0
+    for day, path in _log_shards(log_dir):
+        if day >= last_kept_day:
+            break
+        try:
+            os.remove(path)
+            deleted += 1
+        except OSError:
+            continue
+    return deleted
+
+
+def cached_invoke(app, query: str):
+    """
+    Serves a query from the cache, falling back to the graph on a miss.
+
+    Every request is recorded in the query log so the warming job can
+    mine it and report coverage.
+
+    Args:
+        app: Compiled LangGraph workflow.
+        query (str): Raw user query.
+
+    Returns:
+        tuple: (result dict, source) where source is SOURCE_WARM, SOURCE_LIVE or SOURCE_MISS.
+    """
+    start_time = time.time()
+    cache = get_query_cache()
+    result, priority = cache.get(query)
+    if result is not None:
+        source = SOURCE_WARM if priority == PRIORITY_WARM else SOURCE_LIVE
+    else:
+        result = app.invoke({"input_text": query})
+        cache.put(query, result)
+        source = SOURCE_MISS
+    log_query(query, source, latency=time.time() - start_time)
+    return result, source
@@ -0,0 +1,243 @@
+"""
+Cache warming job for anime recommendations.
+
+Mines the query log for frequent queries, using clusters of near-duplicate
+queries to rank popularity, precomputes each selected query's results through
+the recommendation graph and stores them in the serving cache with warm
+priority. Nothing runs it automatically: call it from your deploy process after
+each deploy and from a scheduler, e.g.:
+
+    uv run warm_cache.py --top 50 --min-count 2
+
+It only helps when QUERY_CACHE_DIR and QUERY_LOG_DIR point at storage that
+persists across deploys and is shared with the serving app.
+"""
+import argparse
+import sys
+import time
+from collections import Counter
+import numpy as np
+from utils.query_cache import (
+    PRIORITY_WARM,
+    QUERY_LOG_DIR,
+    SOURCE_WARM,
+    get_query_cache,
+    normalize_query,
+    prune_query_log,
+    read_query_log,
+)
+from utils.vectore_search import get_embeddings
+
+
+# Rows of the similarity matrix computed per batch when clustering
+SIMILARITY_BATCH_SIZE = 1024
+
+
+def mine_queries(records: list, similarity_threshold: float = 0.9) -> list:
+    """
+    Groups logged queries into clusters of near-duplicate requests.
+
+    Exact repeats are merged by normalized text; the remaining distinct queries
+    are clustered greedily by embedding similarity, most frequent first.
+
+    Args:
+        records (list): Query log records.
+        similarity_threshold (float): Minimum cosine similarity to join a cluster.
+
+    Returns:
+        list: Clusters sorted by total count, each a dict with the representative
+        query, the combined count and its members (normalized key, most common
+        raw form and count), most frequent first.
+    """
+    counts = Counter()
+    raw_forms = {}
+    for record in records:
+        key = normalize_query(record["query"])
+        if not key:
+            continue
+        counts[key] += 1
+        raw_forms.setdefault(key, Counter())[record["query"].strip()] += 1
+
+    keys = [key for key, _ in counts.most_common()]
+    if not keys:
+        return []
+
+    try:
+        vectors = np.asarray(get_embeddings().embed_documents(keys), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1, norms)
+    except Exception as e:
+        print(f"Error embedding queries, clustering by exact match only: {e}")
+        vectors = None
+
+    clusters = []
+    # Index in `clusters` of the cluster each query represents, -1 for non-representatives
+    cluster_of = np.full(len(keys), -1)
+    for idx, key in enumerate(keys):
+        target = None
+        if vectors is not None:
+            if idx % SIMILARITY_BATCH_SIZE == 0:
+                # Cosine similarities of the next batch of queries against all earlier ones
+                batch_sims = vectors[idx:idx + SIMILARITY_BATCH_SIZE] @ vectors[:idx + SIMILARITY_BATCH_SIZE].T
+            sims = batch_sims[idx % SIMILARITY_BATCH_SIZE, :idx]
+            matches = np.flatnonzero((sims >= similarity_threshold) & (cluster_of[:idx] >= 0))
+            if matches.size:
+                # Clusters are created in query order, so the lowest index is the first cluster
+                target = clusters[cluster_of[matches[0]]]
+        member = {
+            "key": key,
+            "query": raw_forms[key].most_common(1)[0][0],
+            "count": counts[key],
+        }
+        if target is None:
+            cluster_of[idx] = len(clusters)
+            clusters.append({
+                "query": member["query"],
+                "members": [member],
+                "count": counts[key],
+            })
+        else:
+            target["members"].append(member)
+            target["count"] += counts[key]
+
+    return sorted(clusters, key=lambda c: c["count"], reverse=True)
+
+
+def select_queries(clusters: list, top: int = 50, min_count: int = 2) -> list:
+    """
+    Picks the queries to precompute from the most popular clusters.
+
+    Clusters only rank popularity: similar queries can still ask for different
+    titles, so each selected query is precomputed on its own. A cluster whose
+    combined count reaches `min_count` contributes its representative plus every
+    member that reaches `min_count` by itself.
+
+    Args:
+        clusters (list): Output of `mine_queries`.
+        top (int): Maximum number of clusters to warm.
+        min_count (int): Minimum number of requests to be warmed.
+
+    Returns:
+        list: Cluster members to warm, in order of cluster popularity.
+    """
+    selected = [c for c in clusters if c["count"] >= min_count][:top]
+    return [
+        member
+        for cluster in selected
+        for idx, member in enumerate(cluster["members"])
+        if idx == 0 or member["count"] >= min_count
+    ]
+
+
+def warm_cache(app, members: list) -> int:
+    """
+    Precomputes results for the selected queries and stores them with warm priority.
+
+    The graph runs once per query and the result is stored only under that query,
+    in the cache directory of the current version. Previously warmed entries that
+    are no longer selected are demoted to live priority, and stale directories of
+    other versions are deleted.
+
+    Args:
+        app: Compiled LangGraph workflow.
+        members (list): Output of `select_queries`.
+
+    Returns:
+        int: Number of queries warmed.
+    """
+    cache = get_query_cache()
+    cache.purge_other_versions()
+    cache.demote_warm_entries({member["key"] for member in members})
+
+    warmed = 0
+    for member in members:
+        start_time = time.time()
+        try:
+            result = app.invoke({"input_text": member["query"]})
+        except Exception as e:
+            print(f"Error warming '{member['query']}': {e}")
+            continue
+        if not cache.put(member["key"], result, priority=PRIORITY_WARM):
+            print(f"Skipped warming '{member['query']}': empty or unsaved result")
+            continue
+        warmed += 1
+        print(f"Warmed '{member['query']}' ({member['count']} requests) "
+              f"in {time.time() - start_time:.2f} seconds")
+
+    return warmed
+
+
+def report_coverage(records: list) -> float:
+    """
+    Reports the share of live traffic served from warmed entries.
+
+    Args:
+        records (list): Query log records.
+
+    Returns:
+        float: Warm coverage between 0 and 1 (0 when there is no traffic).
+    """
+    if not records:
+        print("Coverage: no traffic in the selected window")
+        return 0.0
+
+    sources = Counter(record.get("source") for record in records)
+    total = len(records)
+    coverage = sources[SOURCE_WARM] / total
+    print(f"Coverage: {coverage:.1%} of {total} requests served from warmed entries "
+          f"({dict(sources)})")
+    return coverage
+
+
+def main() -> int:
+    """
+    Runs the warming job and returns the process exit code.
+
+    Returns:
+        int: 0 on success, 1 if queries were selected but none could be warmed.
+    """
+    parser = argparse.ArgumentParser(description="Warm the recommendation cache from query logs.")
+    parser.add_argument("--top", type=int, default=50, help="Maximum number of query clusters to warm")
+    parser.add_argument("--min-count", type=int, default=2, help="Minimum requests for a cluster to be warmed")
+    parser.add_argument("--similarity", type=float, default=0.9, help="Cosine similarity threshold for clustering")
+    parser.add_argument("--window-hours", type=float, default=24 * 7,
+                        help="How far back to mine the query log; older log files are deleted")
+    parser.add_argument("--coverage-hours", type=float, default=1, help="Window for the coverage report")
+    parser.add_argument("--report-only", action="store_true", help="Only report coverage, do not warm")
+    args = parser.parse_args()
+
+    now = time.time()
+    report_coverage(read_query_log(since=now - args.coverage_hours * 3600))
+    if args.report_only:
+        return 0
+
+    # Import lazily so --report-only does not need LLM credentials
+    from graph.graph import app
+
+    window_start = now - args.window_hours * 3600
+    records = read_query_log(since=window_start)
+    if not records:
+        print(f"Warning: no queries logged in the last {args.window_hours:g} hours under "
+              f"'{QUERY_LOG_DIR}'; nothing to warm. Check that QUERY_LOG_DIR points at "
+              "persistent storage shared with the app.")
+    clusters = mine_queries(records, args.similarity)
+    pruned = prune_query_log(min(window_start, now - args.coverage_hours * 3600))
+    if pruned:
+        print(f"Deleted {pruned} query log files older than the mining window")
+    members = select_queries(clusters, top=args.top, min_count=args.min_count)
+    print(f"Mined {len(clusters)} query clusters from the query log, {len(members)} queries selected")
+    warmed = warm_cache(app, members)
+    print(f"Warmed {warmed} queries ({len(get_query_cache())} entries in cache version "
+          f"{get_query_cache().version})")
+    if members and not warmed:
+        print("Error: every selected query failed to warm")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        sys.exit(1)